@@ -1,10 +1,56 @@
+from collections.abc import Mapping
+from functools import lru_cache
 from typing import Tuple, Dict, List
 
 import numpy as np
 import os
+import tempfile
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, the kernels below run as plain Python without it
+    prange = range
 
-def parse_hds(file_path: str, nlay: int, nrow: int, ncol: int) -> Tuple[Dict[Tuple[int, int], np.array], np.array]:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+@lru_cache(maxsize=None)
+def _cbbu_dt(n: int) -> np.dtype:
+    """
+    Build (once per array size) the data type of an unstructured budget record holding n values.
+    """
+    return np.dtype([
+        ('kstp', 'i4'),
+        ('kper', 'i4'),
+        ('text', 'S16'),
+        ('nval', 'i4'),
+        ('one', 'i4'),
+        ('icode', 'i4'),
+        ('data', 'f4', int(n))
+    ])
+
+
+@lru_cache(maxsize=None)
+def _budget_text(raw: bytes) -> str:
+    """
+    Decode (once per distinct value) a budget item name, stripped of white space.
+    """
+    return raw.decode().strip()
+
+
+@njit(parallel=True, cache=True)
+def _fill_records(raw: np.array, offsets: np.array, counts: np.array, starts: np.array, out: np.array):
+    """
+    Copy the data of every record (counts[i] values at offsets[i] of raw) into out[starts[i]:].
+    Records write to disjoint slices of out so they are processed in parallel.
+    """
+    for i in prange(offsets.shape[0]):
+        out[starts[i]:starts[i] + counts[i]] = raw[offsets[i]:offsets[i] + counts[i]]
+
+
+def parse_hds(file_path: str, nlay: int, nrow: int, ncol: int, copy: bool = False) \
+        -> Tuple[Dict[Tuple[int, int], np.array], np.array]:
     """
     This function will parse a binary structured *.hds (head) file and will return a tuple with two items.
     The first item is a dictionary containing the head arrays as values and stress periods/time steps tuples as keys.
@@ -20,6 +66,8 @@ def parse_hds(file_path: str, nlay: int, nrow: int, ncol: int) -> Tuple[Dict[Tup
         nlay : number of layers in the model.
         nrow : number of rows in the model.
         ncol : number of columns in the model.
+        copy : if True, copy each head array into memory; otherwise the arrays are read-only
+               views into the memory-mapped file.
 
     Returns:
         The first item is a dictionary containing the head arrays as values and stress periods/time steps tuples as keys.
@@ -28,32 +76,142 @@ def parse_hds(file_path: str, nlay: int, nrow: int, ncol: int) -> Tuple[Dict[Tup
     """
     if file_path is None or nlay == 0 or nrow == 0 or ncol == 0:
         return {}, np.empty(0)
+    dt = np.dtype([
+        ('kstp', 'i4'),
+        ('kper', 'i4'),
+        ('pertim', 'f4'),
+        ('totim', 'f4'),
+        ('text', 'S16'),
+        ('ncol', 'i4'),
+        ('nrow', 'i4'),
+        ('ilay', 'i4'),
+        ('data', 'f4', (nrow, ncol))
+    ])
     file_size = os.path.getsize(file_path)
-    offset = 0
+    if file_size % (dt.itemsize * nlay):
+        raise ValueError(f'{file_path} does not hold whole head records for nlay={nlay}, nrow={nrow}, ncol={ncol}')
+    n_records = file_size // (dt.itemsize * nlay)
+    if n_records == 0:
+        return {}, np.empty(0)
+    mm = np.memmap(file_path, mode='r', dtype=dt, shape=(n_records, nlay))
     hds = {}
     totim = []
-    while offset < file_size:
-        dt = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('pertim', 'f4'),
-            ('totim', 'f4'),
-            ('text', 'S16'),
-            ('ncol', 'i4'),
-            ('nrow', 'i4'),
-            ('ilay', 'i4'),
-            ('data', 'f4', (nrow, ncol))
-        ])
-        arr = np.memmap(file_path, mode='r', dtype=dt, offset=offset, shape=nlay)
-        offset += dt.itemsize * nlay
-        kper = arr['kper'][0]
-        kstp = arr['kstp'][0]
-        hds[kper, kstp] = arr['data'].copy()
-        totim.append(arr['totim'][0])
+    for rec in mm:
+        if copy:
+            data = np.empty((nlay, nrow, ncol), 'f4')
+            np.copyto(data, rec['data'])
+        else:
+            data = rec['data']
+        hds[int(rec['kper'][0]), int(rec['kstp'][0])] = data
+        totim.append(float(rec['totim'][0]))
     return hds, np.asarray(totim)
 
 
-def parse_cbb(file_path: str, nlay: int, nrow: int, ncol: int, items: List[str] = None) \
+class _H5Heads(Mapping):
+    """
+    Read-only dictionary of the head arrays cached in an HDF5 file, keyed like the parse_hds dictionary.
+    Arrays are read from the file (one chunk per stress period/time step) only when accessed.
+    Close it (or use it as a context manager) to release the HDF5 file.
+    """
+
+    def __init__(self, h5_file):
+        self._file = h5_file
+        self._hds = h5_file['hds']
+        keys = zip(h5_file['kper'][:].tolist(), h5_file['kstp'][:].tolist())
+        self._index = {key: i for i, key in enumerate(keys)}
+
+    def __getitem__(self, key: Tuple[int, int]) -> np.array:
+        return self._hds[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+
+def _hds_cache_is_valid(cache_h5: str, file_path: str, nlay: int, nrow: int, ncol: int) -> bool:
+    """
+    Check that the HDF5 cache exists, is newer than the HDS file and was built for the same model dimensions.
+    """
+    import h5py
+
+    if not os.path.exists(cache_h5) or os.path.getmtime(cache_h5) <= os.path.getmtime(file_path):
+        return False
+    try:
+        with h5py.File(cache_h5, 'r') as f:
+            return (
+                all(name in f for name in ('hds', 'kper', 'kstp', 'totim'))
+                and (f.attrs.get('nlay'), f.attrs.get('nrow'), f.attrs.get('ncol')) == (nlay, nrow, ncol)
+            )
+    except OSError:
+        return False
+
+
+def parse_hds_cached(file_path: str, nlay: int, nrow: int, ncol: int, cache_h5: str = None) \
+        -> Tuple[Mapping, np.array]:
+    """
+    Same as parse_hds but the parsed heads are cached in an HDF5 file so subsequent calls read only
+    the requested arrays instead of parsing the binary file again. The cache is rebuilt when it is
+    older than the HDS file or was built for different model dimensions. Heads are stored with one chunk
+    per stress period/time step and LZF compression. The cache is written to a temporary file first and
+    then moved in place, so an interrupted write never leaves a partial cache behind. Requires h5py.
+
+    Args:
+        file_path : input HDS file name.
+        nlay : number of layers in the model.
+        nrow : number of rows in the model.
+        ncol : number of columns in the model.
+        cache_h5 : HDF5 cache file name, defaults to the HDS file name with an .h5 suffix.
+
+    Returns:
+        The first item is a read-only dictionary containing the head arrays as values and
+        stress periods/time steps tuples as keys, arrays are read from the cache on access
+        (close it when done to release the cache file).
+        The second item is an array of total times matching the length of the dictionary.
+    """
+    import h5py
+
+    if cache_h5 is None:
+        cache_h5 = f'{file_path}.h5'
+    if not _hds_cache_is_valid(cache_h5, file_path, nlay, nrow, ncol):
+        hds, totim = parse_hds(file_path, nlay, nrow, ncol)
+        fd, tmp_h5 = tempfile.mkstemp(suffix='.h5', dir=os.path.dirname(os.path.abspath(cache_h5)))
+        os.close(fd)
+        try:
+            with h5py.File(tmp_h5, 'w') as f:
+                f.attrs['nlay'] = nlay
+                f.attrs['nrow'] = nrow
+                f.attrs['ncol'] = ncol
+                # unlimited first dimension so the per-record chunk is allowed even without records
+                dset = f.create_dataset(
+                    'hds', shape=(len(hds), nlay, nrow, ncol), maxshape=(None, nlay, nrow, ncol),
+                    chunks=(1, nlay, nrow, ncol), compression='lzf', dtype='f4'
+                )
+                for i, data in enumerate(hds.values()):
+                    dset[i] = data
+                f.create_dataset('kper', data=np.array([kper for kper, _ in hds], dtype='i4'))
+                f.create_dataset('kstp', data=np.array([kstp for _, kstp in hds], dtype='i4'))
+                f.create_dataset('totim', data=totim)
+            # replace rather than truncate so readers holding the previous cache open are not affected
+            os.replace(tmp_h5, cache_h5)
+        except BaseException:
+            os.remove(tmp_h5)
+            raise
+    h5_file = h5py.File(cache_h5, 'r')
+    return _H5Heads(h5_file), h5_file['totim'][:]
+
+
+def parse_cbb(file_path: str, nlay: int, nrow: int, ncol: int, items: List[str] = None, copy: bool = False) \
         -> Dict[str, Dict[Tuple[int, int], np.array]]:
     """
     This function will parse a binary structured *.cbb (budget) file and will return a dictionary.
@@ -71,6 +229,8 @@ def parse_cbb(file_path: str, nlay: int, nrow: int, ncol: int, items: List[str]
         ncol : number of columns in the model.
         items: list of budget items to return; large budget files can exceed
                available memory so limit the returned items.
+        copy : if True, copy each flux array into memory; otherwise the arrays are read-only
+               views into the memory-mapped file.
 
     Returns:
         dictionary with flux items as keys and for values a dictionary similar to the HDS parser,
@@ -78,31 +238,39 @@ def parse_cbb(file_path: str, nlay: int, nrow: int, ncol: int, items: List[str]
         white space at the beginning and at the end.
         {'RECHARGE': {(kper: int, kstp: int): np.array}}.
     """
+    dt = np.dtype([
+        ('kstp', 'i4'),
+        ('kper', 'i4'),
+        ('text', 'S16'),
+        ('ncol', 'i4'),
+        ('nrow', 'i4'),
+        ('nlay', 'i4'),
+        ('data', 'f4', (nlay, nrow, ncol))
+    ])
     file_size = os.path.getsize(file_path)
-    offset = 0
+    if file_size % dt.itemsize:
+        raise ValueError(f'{file_path} does not hold whole budget records for nlay={nlay}, nrow={nrow}, ncol={ncol}')
+    n_records = file_size // dt.itemsize
+    if n_records == 0:
+        return {}
+    mm = np.memmap(file_path, mode='r', dtype=dt, shape=(n_records,))
+    # read the record headers as whole columns, the data field is a view over all records
+    texts = mm['text']
+    kpers = mm['kper'].tolist()
+    kstps = mm['kstp'].tolist()
+    records = mm['data']
+    items = set(items) if items else None
     cbb = {}
-    while offset < file_size:
-        dt = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('text', 'S16'),
-            ('ncol', 'i4'),
-            ('nrow', 'i4'),
-            ('nlay', 'i4'),
-            ('data', 'f4', (nlay, nrow, ncol))
-        ])
-        arr = np.memmap(file_path, mode='r', dtype=dt, offset=offset, shape=1)[0]
-        offset += dt.itemsize
-        text = arr['text'].decode().strip()
-        kper = arr['kper']
-        kstp = arr['kstp']
-        if items and text in items:
-            cbb.setdefault(text, {})
-            cbb[text][kper, kstp] = arr['data'].copy()
+    for i in range(n_records):
+        text = _budget_text(bytes(texts[i]))
+        if items and text not in items:
             continue
-        elif not items:
-            cbb.setdefault(text, {})
-            cbb[text][kper, kstp] = arr['data'].copy()
+        if copy:
+            data = np.empty((nlay, nrow, ncol), 'f4')
+            np.copyto(data, records[i])
+        else:
+            data = records[i]
+        cbb.setdefault(text, {})[kpers[i], kstps[i]] = data
 
     return cbb
 
@@ -116,8 +284,8 @@ def parse_hdsu(file_path: str) -> Dict[Tuple[int, int], np.array]:
     because some compilers will add some padding bytes within the data type defined below.
 
     Note: many of the variables are named to be consistent with their naming convention in the source code and
-          code documentation. Unlike the structured parser, the data type needs to be changed in-flight as
-          the number of nodes varies among layers.
+          code documentation. Unlike the structured parser, the number of nodes varies among layers so
+          the file is scanned twice: once to locate the layer records and once to fill the head arrays.
 
     Args:
         file_path: input unstructured *.hds file name.
@@ -126,44 +294,46 @@ def parse_hdsu(file_path: str) -> Dict[Tuple[int, int], np.array]:
         dictionary containing the head arrays as values and stress periods/time steps tuples as keys.
         {(kper: int, kstp: int): np.array}.
     """
+    dtmeta = np.dtype([
+        ('kstp', 'i4'),
+        ('kper', 'i4'),
+        ('pertim', 'f4'),
+        ('totim', 'f4'),
+        ('text', 'S16'),
+        ('nstrt', 'i4'),
+        ('nndlay', 'i4'),
+        ('ilay', 'i4')
+    ])
     file_size = os.path.getsize(file_path)
+    if file_size == 0:
+        return {}
+    mm = np.memmap(file_path, mode='r', dtype='u1', shape=(file_size,))
     offset = 0
-    HDS = {}
+    # first pass: collect the data offset and node count of every layer record, grouped by stress period/time step
+    records = {}
     while offset < file_size:
-        dtmeta = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('pertim', 'f4'),
-            ('totim', 'f4'),
-            ('text', 'S16'),
-            ('nstrt', 'i4'),
-            ('nndlay', 'i4'),
-            ('ilay', 'i4')
-        ])
-        meta = np.memmap(file_path, mode='r', dtype=dtmeta, offset=offset, shape=1)[0]
-        nstrt = meta['nstrt']
-        nndlay = meta['nndlay']
-        kper = meta['kper']
-        kstp = meta['kstp']
-        ilay = meta['ilay']
-        if ilay == 1:
-            h = np.empty(0)
-        n = nndlay - nstrt + 1
-        dt = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('pertim', 'f4'),
-            ('totim', 'f4'),
-            ('text', 'S16'),
-            ('nstrt', 'i4'),
-            ('nndlay', 'i4'),
-            ('ilay', 'i4'),
-            ('data', 'f4', n)
-        ])
-        arr = np.memmap(file_path, mode='r', dtype=dt, offset=offset, shape=1)[0]
-        h = np.concatenate((h, arr['data']))
-        offset += dt.itemsize
-        HDS[kper, kstp] = h
+        if offset + dtmeta.itemsize > file_size:
+            raise ValueError(f'truncated layer record at byte {offset} of {file_path}')
+        meta = mm[offset:offset + dtmeta.itemsize].view(dtmeta)[0]
+        n = int(meta['nndlay'] - meta['nstrt'] + 1)
+        if n < 0 or offset + dtmeta.itemsize + 4 * n > file_size:
+            raise ValueError(f'invalid or truncated layer record at byte {offset} of {file_path}')
+        records.setdefault((int(meta['kper']), int(meta['kstp'])), []).append((offset + dtmeta.itemsize, n))
+        offset += dtmeta.itemsize + n * 4
+    # second pass: copy all layer records into one preallocated array; records are made of 4-byte words
+    # so the whole file can be viewed as float32 and byte offsets converted to word offsets
+    offsets = np.array([ofst for layers in records.values() for ofst, _ in layers], dtype=np.int64) // 4
+    counts = np.array([n for layers in records.values() for _, n in layers], dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    heads = np.empty(counts.sum(), 'f4')
+    raw = mm[:file_size // 4 * 4].view(np.float32).view(np.ndarray)
+    _fill_records(raw, offsets, counts, starts, heads)
+    HDS = {}
+    start = 0
+    for (kper, kstp), layers in records.items():
+        size = sum(n for _, n in layers)
+        HDS[kper, kstp] = heads[start:start + size]
+        start += size
     return HDS
 
 
@@ -189,35 +359,31 @@ def parse_cbbu(file_path: str, items: List[str] = None) -> Dict[Tuple[str, int,
             {((item: str, array_size: int), kper: int, kstp: int): np.array}.
 
     """
+    dtmeta = np.dtype([
+        ('kstp', 'i4'),
+        ('kper', 'i4'),
+        ('text', 'S16'),
+        ('nval', 'i4'),
+        ('one', 'i4'),
+        ('icode', 'i4')
+    ])
     fSize = os.path.getsize(file_path)
     print(fSize)
+    if fSize == 0:
+        return {}
+    mm = np.memmap(file_path, mode='r', dtype='u1', shape=(fSize,))
+    items = set(items) if items else None
     ofst = 0
     BUD = {}
     while ofst < fSize:
-        dtmeta = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('text', 'S16'),
-            ('nval', 'i4'),
-            ('one', 'i4'),
-            ('icode', 'i4')
-        ])
-        meta = np.memmap(file_path, mode='r', dtype=dtmeta, offset=ofst, shape=1)[0]
-        arr_size = meta['nval']
-        dtu = np.dtype([
-            ('kstp', 'i4'),
-            ('kper', 'i4'),
-            ('text', 'S16'),
-            ('nval', 'i4'),
-            ('one', 'i4'),
-            ('icode', 'i4'),
-            ('data', 'f4', arr_size)
-        ])
-        data = np.memmap(file_path, mode='r', dtype=dtu, offset=ofst, shape=1)[0]
+        meta = mm[ofst:ofst + dtmeta.itemsize].view(dtmeta)[0]
+        arr_size = int(meta['nval'])
+        dtu = _cbbu_dt(arr_size)
+        data = mm[ofst:ofst + dtu.itemsize].view(dtu)[0]
         ofst += dtu.itemsize
         kper = data['kper']
         kstp = data['kstp']
-        text = data['text'].decode().strip()
+        text = _budget_text(bytes(data['text']))
         if items and text in items:
             BUD[text, arr_size, kper, kstp] = data['data']
             continue
@@ -1,4 +1,3 @@
-from matplotlib.patches import Rectangle
 import os
 import numpy as np
 from datetime import datetime as dt
@@ -24,10 +23,6 @@ FIG_DIR = 'figures'
 NLAY = 9
 COLNUM = 54
 
-COLORS = ['b', 'g', '#aaaaaa']
-PROXY = [Rectangle((0, 0), 0, 0, facecolor=c, linewidth=.08) for c in COLORS]
-FIG_LABELS = ['Recharge', 'GHB', 'Active']
-
 user_agent = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:106.0) Gecko/20100101 Firefox/106.0'
 HEADERS = {
     'User-Agent': user_agent,
@@ -63,7 +58,7 @@ precip_breaks = np.array([
     .04, .08, .12, .2, .28, .4, .6, .8, 1., 1.2, 1.6, 2,
     2.4, 2.8, 3.2, 3.6, 4, 5, 6, 7, 8, 10, 12, 15, 20
 ])
-PRECIP_MEAN_SCALE = (precip_breaks[:-1] + precip_breaks[1:]) / 2
+PRECIP_MEAN_SCALE = ((precip_breaks[:-1] + precip_breaks[1:]) / 2).astype(np.float32)
 PRECIP_COLOR_PICKER = [[680] * len(precip_palette_indices), precip_palette_indices]
 
 temp_palette_indices = [
@@ -77,10 +72,10 @@ temp_breaks = np.array([
 ])
 temp_indices = np.arange(len(temp_palette_indices) + 1)
 temp_interpolated = np.interp(temp_indices, temp_indices[::3], temp_breaks)
-TEMP_MEAN_SCALE = (temp_interpolated[:-1] + temp_interpolated[1:]) / 2
+TEMP_MEAN_SCALE = ((temp_interpolated[:-1] + temp_interpolated[1:]) / 2).astype(np.float32)
 TEMP_COLOR_PICKER = [[680] * len(temp_palette_indices), temp_palette_indices]
 
-SNOW_TO_LIQUID = np.interp(temp_indices, [0, 15, 18, 26, 30, 77], [25, 25, 20, 15, 10, 10])
+SNOW_TO_LIQUID = np.interp(temp_indices, [0, 15, 18, 26, 30, 77], [25, 25, 20, 15, 10, 10]).astype(np.float32)
 
 # breckenridge [400:460, 380:430]
 # peaceful valley [210:295, 150:265]
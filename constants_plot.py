@@ -0,0 +1,6 @@
+from matplotlib.patches import Rectangle
+
+
+COLORS = ['b', 'g', '#aaaaaa']
+PROXY = [Rectangle((0, 0), 0, 0, facecolor=c, linewidth=.08) for c in COLORS]
+FIG_LABELS = ['Recharge', 'GHB', 'Active']
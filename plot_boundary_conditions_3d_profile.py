@@ -2,13 +2,14 @@ from typing import List, Tuple, Dict
 
 import numpy as np
 import os
+import warnings
 import arcpy as arc
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
-from matplotlib.patches import Rectangle
-from matplotlib.collections import PatchCollection
+from matplotlib.collections import PolyCollection
 
 import constants as const
+import constants_plot as const_plot
 
 import matplotlib as mpl
 
@@ -31,23 +32,43 @@ def float_format(x: float) -> str:
     return '{:,.1f}'.format(x)
 
 
-def plot_properties_full_extent(
-        patches: List[List[Rectangle], List[Rectangle], List[Rectangle]], dis: Dict[str, np.array], figure_path: str):
+def cell_polygons(x: np.array, y: np.array, w: np.array, h: np.array) -> np.array:
+    """
+    Build the polygon vertices of rectangular grid cells
+    Args:
+        x: left edge of the cells
+        y: bottom edge of the cells
+        w: width of the cells
+        h: height of the cells
+
+    Returns:
+        array of shape (n, 4, 2) with the corners of every cell
+    """
+    x, y, w, h = (np.asarray(v, dtype=float) for v in (x, y, w, h))
+    return np.stack([
+        np.stack([x, y], axis=-1),
+        np.stack([x + w, y], axis=-1),
+        np.stack([x + w, y + h], axis=-1),
+        np.stack([x, y + h], axis=-1),
+    ], axis=1)
+
+
+def plot_properties_full_extent(cells: List[np.array], dis: Dict[str, np.array], figure_path: str):
     """
     Plot the 3D aquifer properties along the full extent of the cross-section
     Args:
-        patches: list of rectangles (grid cells) to be plotted
+        cells: polygon vertices of the grid cells to be plotted, one array per category (recharge, GHB, active)
         dis: discretization dictionary with top/bottom elevations
         figure_path: output figure path
     """
     fig, ax = plt.subplots(figsize = (12, 6))
     fig.suptitle('Cross-Section #3', fontsize=10)
-    for i, pl in enumerate(patches):
-        patch_collection = PatchCollection(pl)
-        patch_collection.set_linewidth(.08)
-        patch_collection.set_facecolor(const.COLORS[i])
-        patch_collection.set_label(const.FIG_LABELS[i])
-        ax.add_collection(patch_collection)
+    for i, verts in enumerate(cells):
+        poly_collection = PolyCollection(verts)
+        poly_collection.set_linewidth(.08)
+        poly_collection.set_facecolor(const_plot.COLORS[i])
+        poly_collection.set_label(const_plot.FIG_LABELS[i])
+        ax.add_collection(poly_collection)
     for well in const.PUMPING_NODES:
         ax.plot((well[0] * 5280, well[0] * 5280), (dis['top'][well[1] - 1], dis['bot'][well[2] - 1]), c='k')
         ax.annotate(
@@ -67,7 +88,7 @@ def plot_properties_full_extent(
     ax.set_xticklabels([float_format(x) for x in np.linspace(0, 83, 9)])
     ax.set_xlabel('Distance (miles)')
     ax.set_ylabel('Elevation (feet)')
-    ax.legend(const.PROXY, const.FIG_LABELS)
+    ax.legend(const_plot.PROXY, const_plot.FIG_LABELS)
     plt.savefig(figure_path, bbox_inches='tight', dpi=300)
     plt.close()
 
@@ -83,11 +104,11 @@ def get_model_arrays(properties_file: str) -> np.array:
         a numpy array containing a specific property (top/bottom elevation, hydraulic conductivity, etc.)
         for every node location
     """
-    props = np.empty(0)
-    for layer in range(const.NLAY):
-        with open(properties_file.format(layer), 'r') as f:
-            props = np.concatenate((props, np.array(f.read().split(), dtype='float')))
-    return props
+    with warnings.catch_warnings():
+        # older NumPy only warns and truncates on unparsable values, make it raise like newer versions
+        warnings.simplefilter('error', DeprecationWarning)
+        chunks = [np.fromfile(properties_file.format(layer), dtype=np.float32, sep=' ') for layer in range(const.NLAY)]
+    return np.concatenate(chunks)
 
 
 def main():
@@ -98,10 +119,11 @@ def main():
     for k, file_path in const.PROP_FILES.items():
         dis[k] = get_model_arrays(file_path)
 
-    rch = dict.fromkeys(np.loadtxt(const.RCH_FILE, dtype='int'))
-    ghb = dict.fromkeys(np.loadtxt(const.GHB_FILE, dtype='int', comments='-1', skiprows=2, usecols=(0,)))
+    rch = np.sort(np.loadtxt(const.RCH_FILE, dtype='int64'))
+    ghb = np.sort(np.loadtxt(const.GHB_FILE, dtype='int64', comments='-1', skiprows=2, usecols=(0,)))
 
-    patch_list = [[], [], []]
+    # cell polygons of each layer in each category: recharge, GHB, active
+    cells = [[] for _ in const_plot.COLORS]
     for layer in range(const.NLAY):
         sql = '''
             "layer"={} and "col"={} and "child_loca" in ('', '1', '32', '34', '122', '124', '142', '144', '322', 
@@ -109,27 +131,18 @@ def main():
         '''.format(layer + 1, const.COLNUM)
         grd = arc.da.FeatureClassToNumPyArray(const.QUADTREE_GRID, ['nodenumber', 'SHAPE@XY', 'delr', 'row'], sql)
         nq = grd['nodenumber'].astype('int') - 1
-        centroid = grd['SHAPE@XY']
         offset = (grd['row'][0] - 1) * 5280.
-        zipped_data = zip(centroid, grd['delr'], dis['top'][nq], dis['bot'][nq], nq)
-        dx = offset
-        if nq[0] in rch:
-            patch_list[0].append([Rectangle((dx, x[3]), x[1], x[2] - x[3]) for x in zipped_data[:1]][0])
-        elif nq[0] in ghb:
-            patch_list[1].append([Rectangle((dx, x[3]), x[1], x[2] - x[3]) for x in zipped_data[:1]][0])
-        else:
-            patch_list[2].append([Rectangle((dx, x[3]), x[1], x[2] - x[3]) for x in zipped_data[:1]][0])
-        dx += zipped_data[0][1]
-        for g in zipped_data[1:]:
-            if g[4] in rch:
-                patch_list[0].append(Rectangle((dx, g[3]), g[1], g[2] - g[3]))
-            elif g[4] in ghb:
-                patch_list[1].append(Rectangle((dx, g[3]), g[1], g[2] - g[3]))
-            else:
-                patch_list[2].append(Rectangle((dx, g[3]), g[1], g[2] - g[3]))
-            dx += g[1]
+        delr = grd['delr']
+        dx = offset + np.concatenate(([0.], np.cumsum(delr[:-1])))
+        bot = dis['bot'][nq]
+        height = dis['top'][nq] - bot
+        is_rch = np.isin(nq, rch)
+        is_ghb = np.isin(nq, ghb) & ~is_rch
+        is_act = ~(is_rch | is_ghb)
+        for category, mask in enumerate((is_rch, is_ghb, is_act)):
+            cells[category].append(cell_polygons(dx[mask], bot[mask], delr[mask], height[mask]))
     fig_file_path = '{}/boundary'.format(const.FIG_DIR)
-    plot_properties_full_extent(patch_list, dis, fig_file_path)
+    plot_properties_full_extent([np.concatenate(c) for c in cells], dis, fig_file_path)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,8 @@
 import smtplib
 import ssl
-import tempfile
 import constants as const
 from datetime import datetime as dt
-import pandas as pd
+import numpy as np
 import requests
 from email.message import EmailMessage
 from dotenv import load_dotenv
@@ -15,15 +14,17 @@ def read_snotel(station: str, url: str):
     snoreq = requests.get(url, headers=const.HEADERS)
     if snoreq.status_code != 200:
         return None
-    with tempfile.TemporaryFile() as tmp:
-        tmp.write(snoreq.content)
-        tmp.seek(0)
-        df = pd.read_csv(tmp, comment='#')
-    df['Snow Depth (in)'] = df['Snow Depth (in)'].clip(0, None)
-    df['Date'] = pd.to_datetime(df['Date'])
-    df = df.set_index(df['Date'])
-    roll_df = df['Snow Depth (in)'].rolling('3h').mean().dropna()
-    return roll_df.iloc[-1]
+    lines = [line for line in snoreq.text.splitlines() if not line.startswith('#')]
+    column = lines[0].split(',').index('Snow Depth (in)')
+    # hourly readings, so the 3-hour mean is the mean of the last three valid samples;
+    # the trailing rows are parsed first and the whole station history only if they hold no valid sample
+    for rows in (lines[1:][-6:], lines[1:]):
+        depth = np.genfromtxt(rows, delimiter=',', usecols=(column,), dtype='f4')
+        depth = np.clip(np.atleast_1d(depth), 0, None)
+        last_valid = depth[~np.isnan(depth)][-3:]
+        if last_valid.size:
+            return float(last_valid.mean())
+    return None
 
 
 def email_snow_depth(account: str, subject: str, message: str):
@@ -47,7 +48,8 @@ def main():
     date_label = const.NOW.strftime('%b %d, %H:%M')
     depths = []
     for station, url in const.SNOTEL.items():
-        depths.append(f'{station.title()}: {read_snotel(station, url):.1f}')
+        depth = read_snotel(station, url)
+        depths.append(f'{station.title()}: {depth:.1f}' if depth is not None else f'{station.title()}: n/a')
     subject = f'Snow depth {date_label}'
     message = ' | '.join(depths)
     print(f'{subject}: {message}')
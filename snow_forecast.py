@@ -1,8 +1,8 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
-import pandas as pd
-from typing import Tuple, Dict, List, Optional
+from typing import Tuple, List, Optional
 from datetime import datetime as dt, timedelta, timezone
 import os
 import smtplib
@@ -10,6 +10,8 @@ import ssl
 from time import sleep
 import random
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from email.message import EmailMessage
 from dotenv import load_dotenv
 import tempfile
@@ -36,45 +38,50 @@ def get_forecast_period(forecast_dt: dt, hrs: int) -> str:
     return f'{from_mt_format} to {to_mt_format}'
 
 
+def build_palette(
+        band: np.array, color_picker: List[List[int]], mean_scale: np.array
+) -> np.array:
+    """
+    Builds a lookup table from the pixel values (palette indices) of a forecast image to the scale values
+    Args:
+        band: the image as an array of palette indices
+        color_picker: list of X/Y for scale pixels
+        mean_scale: actual values array for the scale
+
+    Returns:
+        array of 256 scale values indexed by pixel value, NaN for pixels that are not part of the scale
+    """
+    colors = band[color_picker[0], color_picker[1]]
+    values = np.asarray(mean_scale)[:len(colors)]
+    # the last occurrence of a repeated color wins, same as building a dict from the pairs
+    keys, idx = np.unique(colors[::-1], return_index=True)
+    lut = np.full(256, np.nan, 'f4')
+    lut[keys] = values[::-1][idx]
+    return lut
+
+
 def get_snow_forecast(
         location: str, precip_band: np.array, temp_band: np.array,
-        precip_palette: Dict[Tuple[int, int], float], temp_palette: Dict[Tuple[int, int], float],
-        row_slice: Tuple[int, int], col_slice: Tuple[int, int]
+        precip_palette: np.array, stl_palette: np.array
 ) -> Optional[str]:
     """
     Compute the snow forecast from forecasted accumulated precipitation
     Args:
         location: location to compute forecast for
-        precip_band: precipitation array from precipitation image
-        temp_band: temperature array from temperature image
+        precip_band: precipitation array cropped from precipitation image
+        temp_band: temperature array cropped from temperature image
         precip_palette: precipitation palette
-        temp_palette: temperature palette
-        row_slice: rows to be used from arrays
-        col_slice: columns to be used from arrays
+        stl_palette: snow to liquid ratio palette keyed on the temperature image pixels
 
     Returns:
-        formatted forecast message if precipitation was forecasted within the row/col window, otherwise None, e.g.
+        formatted forecast message if precipitation was forecasted within the cropped window, otherwise None, e.g.
         Peaceful Valley: 1.2in
     """
-    rfrom, rto = row_slice
-    cfrom, cto = col_slice
-    precip_colors = precip_band[rfrom:rto, cfrom:cto].flatten()
-    temp_colors = temp_band[rfrom:rto, cfrom:cto].flatten()
-    stl_ratio = dict(zip(temp_band[const.TEMP_COLOR_PICKER[0], const.TEMP_COLOR_PICKER[1]], const.SNOW_TO_LIQUID))
-    df = pd.DataFrame({
-        'precip_colors': precip_colors,
-        'temp_colors': temp_colors,
-    })
-    df['precip'] = df['precip_colors'].map(precip_palette)
-    df['temp'] = df['temp_colors'].map(temp_palette)
-    df['stl'] = df['temp_colors'].map(stl_ratio)
-    df['snow'] = df['precip'] * df['stl']
-
-    df_desc = df.describe()
-    print(df_desc)
-    if pd.isnull(df_desc['snow']['mean']):
+    snow = precip_palette[precip_band] * stl_palette[temp_band]
+    snow = snow[~np.isnan(snow)]
+    if not snow.size:
         return None
-    forecast_text = f"{location.title()}: {df_desc['snow']['mean']:.1f}in"
+    forecast_text = f"{location.title()}: {snow.sum() / snow.size:.1f}in"
     return forecast_text
 
 
@@ -90,24 +97,42 @@ def item_exists(file_path: str) -> bool:
     return os.path.exists(file_path) and os.path.getsize(file_path)
 
 
-def get_band_and_palette(
-        raw_path: str, color_picker: List[List[int], List[int]], mean_scale: np.array
-) -> Tuple[np.array, Dict[Tuple[int, int], float]]:
+def get_image_and_palette(
+        raw_path: str, color_picker: List[List[int]], mean_scale: np.array
+) -> Tuple[Image.Image, np.array]:
     """
-    Reads a forecast image (PNG) and returns it as an array along with
-    a dictionary of a reference to the precipitation/temperatures scales
+    Opens a forecast image (PNG) and returns it along with
+    a reference to the precipitation/snow to liquid ratio scales.
+    Only the image region holding the scale pixels is converted to an array.
     Args:
         raw_path: path to the PNG image
         color_picker: list of X/Y for scale pixels
-        mean_scale: actual values array for precipitation/temperature
+        mean_scale: actual values array for precipitation/snow to liquid ratio
 
     Returns:
-        the image as an array and a reference for the scales (truncated dict example: {(680, 42): 0.2})
+        the image and a reference for the scales (lookup table indexed by pixel value)
     """
     image = Image.open(raw_path)
-    band = np.array(image)
-    palette = dict(zip(band[color_picker[0], color_picker[1]], mean_scale))
-    return band, palette
+    rows, cols = np.asarray(color_picker[0]), np.asarray(color_picker[1])
+    scale_band = np.asarray(image.crop((cols.min(), rows.min(), cols.max() + 1, rows.max() + 1)))
+    palette = build_palette(scale_band, [rows - rows.min(), cols - cols.min()], mean_scale)
+    return image, palette
+
+
+def crop_band(image: Image.Image, row_slice: Tuple[int, int], col_slice: Tuple[int, int]) -> np.array:
+    """
+    Crops a forecast image to an area of interest
+    Args:
+        image: forecast image
+        row_slice: rows to be used from the image
+        col_slice: columns to be used from the image
+
+    Returns:
+        the cropped image as an array
+    """
+    rfrom, rto = row_slice
+    cfrom, cto = col_slice
+    return np.asarray(image.crop((cfrom, rfrom, cto, rto)))
 
 
 def email_forecast(account: str, subject: str, forecast_message: str):
@@ -167,54 +192,85 @@ def get_local_time(now_utc: dt) -> str:
     return local.strftime('%b %d, %H:%M')
 
 
+def get_raw_files(forecast: dt, hrs: int, name: str) -> Tuple[str, str]:
+    """
+    Builds the paths of the raw precipitation and temperature images of a forecast
+    Args:
+        forecast: forecast datetime
+        hrs: forecast length (24, 48, 72)
+        name: zone name
+
+    Returns:
+        precipitation and temperature image paths
+    """
+    label = f'{forecast.year}{forecast.month:02d}{forecast.day:02d}{forecast.hour:02d}_{hrs:03d}'
+    precip_raw_file = f'{const.DATA_PATH}/precip_raw/raw_{name}_forecast_{label}.png'
+    temp_raw_file = f'{const.DATA_PATH}/temp_raw/raw_{name}_forecast_{label}.png'
+    return precip_raw_file, temp_raw_file
+
+
+def download_image(url: str, forecast: dt, hrs: int, zone: str) -> Optional[requests.Response]:
+    """
+    Downloads a forecast image, moving on to another image server if a request fails;
+    short retries on the same server are handled by the session adapter
+    Args:
+        url: precipitation/temperature image URL template
+        forecast: forecast datetime
+        hrs: forecast length (24, 48, 72)
+        zone: forecast zone
+
+    Returns:
+        the response of the first request that went through, otherwise None
+    """
+    sleep(random.randint(1, 3) + random.random())
+    for server in random.sample(range(1, 5), 4):
+        image_url = url.format(server, forecast.year, forecast.month, forecast.day, forecast.hour, hrs, zone)
+        try:
+            return session.get(image_url, headers=const.HEADERS, timeout=10)
+        except requests.exceptions.RequestException:
+            continue
+    return None
+
+
 def main():
-    for forecast in get_forecast_list(const.NOW):
+    forecasts = get_forecast_list(const.NOW)
+    downloads = {}
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for forecast in forecasts:
+            for hrs in [24, 48, 72]:
+                for z, name in const.ZONES.items():
+                    if all(item_exists(raw_file) for raw_file in get_raw_files(forecast, hrs, name)):
+                        continue
+                    for kind, url in [('precip', const.PRECIP_URL), ('temp', const.TEMP_URL)]:
+                        downloads[forecast, hrs, z, kind] = pool.submit(download_image, url, forecast, hrs, z)
+    responses = {k: future.result() for k, future in downloads.items()}
+
+    for forecast in forecasts:
         forecast_sms = defaultdict(list)
         forecast_period = {}
         for hrs in [24, 48, 72]:
-            sleep(random.randint(1, 3) + random.random())
-            label = f'{forecast.year}{forecast.month:02d}{forecast.day:02d}{forecast.hour:02d}_{hrs:03d}'
             for z, name in const.ZONES.items():
-                precip_raw_file = f'{const.DATA_PATH}/precip_raw/raw_{name}_forecast_{label}.png'
-                temp_raw_file = f'{const.DATA_PATH}/temp_raw/raw_{name}_forecast_{label}.png'
-                if item_exists(precip_raw_file) and item_exists(temp_raw_file):
+                preq = responses.get((forecast, hrs, z, 'precip'))
+                treq = responses.get((forecast, hrs, z, 'temp'))
+                if preq is None or treq is None:
                     continue
-                for i in range(1, 5):
-                    sleep(random.randint(1, 3) + random.random())
-                    p_url = const.PRECIP_URL.format(
-                        i, forecast.year, forecast.month, forecast.day, forecast.hour, hrs, z
-                    )
-                    try:
-                        preq = session.get(p_url, headers=const.HEADERS)
-                        break
-                    except requests.exceptions.RequestException as e:
-                        continue
-                for i in range(1, 5):
-                    sleep(random.randint(1, 3) + random.random())
-                    t_url = const.TEMP_URL.format(
-                        i, forecast.year, forecast.month, forecast.day, forecast.hour, hrs, z
-                    )
-                    try:
-                        treq = session.get(t_url, headers=const.HEADERS)
-                        break
-                    except requests.exceptions.RequestException as e:
-                        continue
                 if preq.status_code == 200 and treq.status_code == 200:
+                    precip_raw_file, temp_raw_file = get_raw_files(forecast, hrs, name)
                     with open(precip_raw_file, 'wb') as raw_image:
                         raw_image.write(preq.content)
                     with open(temp_raw_file, 'wb') as raw_image:
                         raw_image.write(treq.content)
-                    p_band, p_palette = get_band_and_palette(
+                    p_image, p_palette = get_image_and_palette(
                         precip_raw_file, const.PRECIP_COLOR_PICKER, const.PRECIP_MEAN_SCALE
                     )
-                    t_band, t_palette = get_band_and_palette(
-                        temp_raw_file, const.TEMP_COLOR_PICKER, const.TEMP_MEAN_SCALE
+                    t_image, stl_palette = get_image_and_palette(
+                        temp_raw_file, const.TEMP_COLOR_PICKER, const.SNOW_TO_LIQUID
                     )
                     forecast_period[hrs] = get_forecast_period(forecast, hrs)
                     for area, rc_slice in const.SLICES[z].items():
-                        snow_forecast = get_snow_forecast(
-                            area, p_band, t_band, p_palette, t_palette, rc_slice['row'], rc_slice['col']
-                        )
+                        p_band = crop_band(p_image, rc_slice['row'], rc_slice['col'])
+                        t_band = crop_band(t_image, rc_slice['row'], rc_slice['col'])
+                        snow_forecast = get_snow_forecast(area, p_band, t_band, p_palette, stl_palette)
                         if not snow_forecast:
                             print(f'No precipitation expected in the forecasted area: {area}.')
                             continue
@@ -225,8 +281,13 @@ def main():
             email_forecast('GMAIL', f'Snow forecast {get_local_time(const.NOW)}', all_msg)
 
 
-# build a global requests Session so cookies are available to all requests
+# build a global requests Session so cookies and connections are available to all requests
 session = requests.Session()
+adapter = HTTPAdapter(
+    pool_connections=16, pool_maxsize=16,
+    max_retries=Retry(total=1, backoff_factor=.5, status_forcelist=[502, 503, 504])
+)
+session.mount('https://', adapter)
 base_req = session.get('https://weather.us', headers=const.HEADERS)
 
 if __name__ == '__main__':